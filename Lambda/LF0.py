@@ -1,5 +1,8 @@
 import boto3
+import hashlib
 import json
+import os
+import uuid
 from botocore.exceptions import ClientError
 # from boto3.dynamodb.conditions import Key
 
@@ -9,6 +12,22 @@ client = boto3.client('lexv2-runtime')
 # Define the client to interact with ASW Lambda
 client_LF3 = boto3.client('lambda')
 
+# 'Event' hands the repeated search to LF3 and answers right away, 'RequestResponse' waits for LF3
+LF3_INVOCATION_TYPE = os.getenv('LF3_INVOCATION_TYPE', 'Event')
+# LF3 records the outcome as repeat_status on the user's last_search item, invoke LF3 with
+# {"mode": "status", "user_email": ..., "request_id": ...} to look it up
+LF3_ACK = 'A recommendation based on your previous search is on its way to your email!'
+
+# every chat window sends its own id with its messages (see chat.js), so concurrent users get separate
+# Lex conversations; Lex session ids are limited to [0-9a-zA-Z._:-], hence the hash
+def get_session_id(event):
+    for message in event.get('messages', []):
+        client_id = message.get('unstructured', {}).get('id')
+        if client_id:
+            return 'web-' + hashlib.sha256(client_id.encode('utf-8')).hexdigest()[:32]
+    return 'test_session'
+
+
 def lookup_data(key, db=None, table='last_search'):
     if not db:
         db = boto3.resource('dynamodb')
@@ -26,13 +45,20 @@ def lookup_data(key, db=None, table='last_search'):
         
 
 
-def insert_data(data_list, db=None, table='last_search'):
+# only sets the attributes in data, so the repeat_request_id and repeat_status LF3 keeps on
+# the last_search item survive the user's next search
+def insert_data(data_list, db=None, table='last_search', key='user_email'):
     if not db:
         db = boto3.resource('dynamodb')
     table = db.Table(table)
-    # overwrite if the same index is provided
     for data in data_list:
-        response = table.put_item(Item=data)
+        attributes = [name for name in data if name != key]
+        response = table.update_item(
+            Key={key: data[key]},
+            UpdateExpression='SET ' + ', '.join(f"#a{i} = :a{i}" for i in range(len(attributes))),
+            ExpressionAttributeNames={f"#a{i}": name for i, name in enumerate(attributes)},
+            ExpressionAttributeValues={f":a{i}": data[name] for i, name in enumerate(attributes)}
+        )
     print('@insert_data: response', response)
     return response
 
@@ -50,6 +76,7 @@ def lambda_handler(event, context):
         msg_from_user += message['unstructured']['text'] + ' '
 
     print(f"Message from frontend: {msg_from_user}")
+    session_id = get_session_id(event)
 
     # Initiate conversation with Lex
     response = client.recognize_text(
@@ -57,7 +84,7 @@ def lambda_handler(event, context):
             # botAliasId='MAUQZ0D8KP',  # version 2
             botAliasId='TSTALIASID', # draft version
             localeId='en_US',
-            sessionId='test_session',
+            sessionId=session_id,
             text=msg_from_user)
     
     
@@ -109,41 +136,28 @@ def lambda_handler(event, context):
                     input_event = {
                         "user_email": user_email,
                         "old_location": old_location,
-                        "old_category": old_category
+                        "old_category": old_category,
+                        "request_id": str(uuid.uuid4())
                     }
                     
                     # get response from LF3
                     response_LF = client_LF3.invoke(
                         FunctionName = 'arn:aws:lambda:us-east-1:267524565890:function:LF3',
-                        InvocationType = 'RequestResponse',
+                        InvocationType = LF3_INVOCATION_TYPE,
                         Payload = json.dumps(input_event)
                     )
                     
-                    response_from_LF3 = json.load(response_LF['Payload'])["body"][1:-1]
+                    if LF3_INVOCATION_TYPE == 'Event':
+                        response_from_LF3 = LF3_ACK
+                    else:
+                        response_from_LF3 = json.load(response_LF['Payload'])["body"][1:-1]
                     
                     print(response_from_LF3)
                     
-                    # send email again to get correct functionality ############################
+                    # LF3 no longer talks to Lex in this session, so the conversation state of
+                    # this turn carries on as is instead of being rebuilt by replaying the
+                    # greeting and the email
                     
-                    response = client.recognize_text(
-                    botId='XYWRSPCNFB', # MODIFY HERE
-                    # botAliasId='MAUQZ0D8KP',  # version 2
-                    botAliasId='TSTALIASID', # draft version
-                    localeId='en_US',
-                    sessionId='test_session',
-                    text=" I need some restaurant suggestions.")
-                    
-                    response = client.recognize_text(
-                    botId='XYWRSPCNFB', # MODIFY HERE
-                    # botAliasId='MAUQZ0D8KP',  # version 2
-                    botAliasId='TSTALIASID', # draft version
-                    localeId='en_US',
-                    sessionId='test_session',
-                    text=user_email)
-                    
-                    msg_from_lex = response.get('messages', [])
-                    session_intent = response.get('interpretations',[])[0]['intent']
-    
                     response_from_lex = response_from_LF3 + ' ' + response_from_lex
                     
                 else:
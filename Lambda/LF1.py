@@ -1,16 +1,34 @@
 import math
-import dateutil.parser
 import datetime
-import time
 import os
 import logging
 import boto3
-import re
+
+from dining_request import encode_request
+from dining_validation import TIMEZONE, validate_dining_suggestions
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
+# clients are created on first use and kept for the lifetime of the container; without KEY_ID and
+# SECRET_KEY they take the function role's credentials from the default chain, which refreshes them
+# before they expire, so a cached client never needs to be rebuilt
+_clients = {}
+
+def get_client(service_name):
+    client = _clients.get(service_name)
+    if client is None:
+        client = boto3.client(service_name, region_name = 'us-east-1',
+                              aws_access_key_id = os.getenv('KEY_ID'),
+                              aws_secret_access_key = os.getenv('SECRET_KEY'))
+        _clients[service_name] = client
+    return client
+
+# WARM_CLIENTS=sqs builds the clients during the init phase instead of on the first fulfillment
+for service_name in filter(None, os.getenv('WARM_CLIENTS', '').split(',')):
+    get_client(service_name.strip())
+
 
 """ --- Helpers to build responses which match the structure of the necessary dialog actions --- """
 
@@ -98,131 +116,18 @@ def parse_int(n):
         return float('nan')
 
 
-def build_validation_result(is_valid, violated_slot, message_content):
-    if message_content is None:
-        return {
-            "isValid": is_valid,
-            "violatedSlot": violated_slot,
-        }
-
-    return {
-        'isValid': is_valid,
-        'violatedSlot': violated_slot,
-        'message': {'contentType': 'PlainText', 'content': message_content}
-    }
-
-
-def isvalid_date(date):
-    try:
-        dateutil.parser.parse(date)
-        return True
-    except ValueError:
-        return False
-
-def validate_dining_suggestions(location, cuisine, party_size, date, time, email):
-    location_types = ['manhattan', 'nyc']
-    if location and location.lower() not in location_types:
-        return build_validation_result(False,
-                                       'location',
-                                       'We do not have suggestions in {}, '
-                                       'you can choose Manhattan or NYC'.format(location))
-
-
-    cuisine_types = ['american', 'italian', 'french', 'spanish', 'chinese', 'mexican', 'japanese',
-                     'korean', 'thai']
-    if cuisine and cuisine.lower() not in cuisine_types:
-        return build_validation_result(False,
-                                       'cuisine',
-                                       'We do not have suggestions in {}, '
-                                       'please try another one such as Japanese'.format(cuisine))
-
-
-
-    if party_size:
-        if not party_size.isnumeric():
-            return build_validation_result(False,
-                                           'party_size',
-                                           'Party Size is invalid. Please input a valid number.')
-
-        if party_size.isnumeric() and (int(party_size) < 1 or int(party_size) > 12):
-            return build_validation_result(False,
-                                           'party_size',
-                                           'We can only give suggestions for a party with 1-12 people, please try again.')
-
-
-
-    if date:
-        if not isvalid_date(date):
-            return build_validation_result(False,
-                                           'date',
-                                           'I did not understand that, you can try today or tomorrow')
-        elif datetime.datetime.strptime(date, '%Y-%m-%d').date() < datetime.date.today():
-            return build_validation_result(False,
-                                           'date',
-                                           'The date can not be earlier than today, please try again.')
-
-
-    if time:
-        if not isvalid_date(date+' '+time):
-            return build_validation_result(False,
-                                           'time',
-                                           'I did not understand that, please input a valid time.')
-        if datetime.datetime.strptime(date+' '+time, '%Y-%m-%d %H:%M') < datetime.datetime.now():
-            return build_validation_result(False,
-                                           'time',
-                                           'The time can not be earlier than now, '
-                                           'please try again.')
-
-        if len(time) != 5:
-            return build_validation_result(False, 'time', None)
-
-
-
-    if email:
-        regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
-        if not (re.fullmatch(regex, email)):
-            return build_validation_result(False,
-                                           'email',
-                                           'The email is invalid, please try again.')
-
-
-    return build_validation_result(True, None, None)
-
-
 # ref: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/sqs-example-sending-receiving-msgs.html
 def push_SQS(location, cuisine, party_size, date, time, email):
-    sqs = boto3.client('sqs', region_name = 'us-east-1',
-                       aws_access_key_id = os.getenv('KEY_ID'),
-                       aws_secret_access_key = os.getenv('SECRET_KEY'))
     url = os.getenv('QUEUE_URL')
-    message_attributes = {
-            'location': {
-                'DataType': 'String',
-                'StringValue': location
-            },
-            'cuisine': {
-                'DataType': 'String',
-                'StringValue': cuisine
-            },
-            'party_size': {
-                'DataType': 'String',
-                'StringValue': party_size
-            },
-            'date': {
-                'DataType': 'String',
-                'StringValue': date
-            },
-            'time': {
-                'DataType': 'String',
-                'StringValue': time
-            },
-            'email': {
-                'DataType': 'String',
-                'StringValue': email
-            }
-        }
-    message_body = 'slots from the user'
-    response = sqs.send_message(QueueUrl=url, MessageAttributes=message_attributes, MessageBody = message_body)
+    message_body = encode_request({
+        'location': location,
+        'cuisine': cuisine,
+        'party_size': party_size,
+        'date': date,
+        'time': time,
+        'email': email
+    })
+    response = get_client('sqs').send_message(QueueUrl=url, MessageBody = message_body)
     print(response)
     logger.debug(response)
 
@@ -254,7 +159,8 @@ def dining_suggestions_intent(intent_request):
     if source == 'DialogCodeHook':
         slots = get_slots(intent_request)
         validation_result = validate_dining_suggestions(location, cuisine, party_size,
-                                                        date, time, email)
+                                                        date, time, email,
+                                                        now=datetime.datetime.now(TIMEZONE))
         if not validation_result['isValid']:
             slots[validation_result['violatedSlot']] = None
 
@@ -306,8 +212,6 @@ def dispatch(intent_request):
 
 
 def lambda_handler(event, context):
-    os.environ['TZ'] = 'America/New_York'
-    time.tzset()
     logger.debug(event)
     return dispatch(event)
 
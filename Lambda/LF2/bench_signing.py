@@ -0,0 +1,59 @@
+import collections
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'package'))
+
+import requests
+from requests_aws4auth import AWS4Auth
+
+from aws_signing import CachingAWS4Auth
+
+
+# Micro-benchmark for signing the OpenSearch requests LF2 sends, with the stock AWS4Auth and
+# with CachingAWS4Auth, both on refreshable credentials as in get_opensearch.
+# Usage: python bench_signing.py
+
+FrozenCredentials = collections.namedtuple('FrozenCredentials', ['access_key', 'secret_key', 'token'])
+
+
+# stands in for botocore's RefreshableCredentials, which is all AWS4Auth reads from it
+class StaticCredentials:
+    def __init__(self):
+        self.frozen = FrozenCredentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY', 'token')
+
+    def get_frozen_credentials(self):
+        return self.frozen
+
+
+def prepare_request():
+    body = json.dumps({"size": 50, "_source": ["restaurantID"],
+                       "query": {"bool": {"filter": [{"term": {"cuisines": "japanese"}}]}}})
+    return requests.Request('POST', 'https://search-restaurants.us-east-1.es.amazonaws.com/restaurants/_search',
+                            data=body, headers={'Content-Type': 'application/json'}).prepare()
+
+
+def sign(auth):
+    return auth(prepare_request()).headers['Authorization']
+
+
+def main(number=5000):
+    credentials = StaticCredentials()
+    signers = {
+        'AWS4Auth': AWS4Auth(region='us-east-1', service='es', refreshable_credentials=credentials),
+        'CachingAWS4Auth': CachingAWS4Auth(region='us-east-1', service='es', refreshable_credentials=credentials),
+    }
+    signatures = {name: sign(auth) for name, auth in signers.items()}
+    # both sign within the same second, so the signatures must match
+    assert len(set(signatures.values())) == 1, signatures
+
+    baseline = min(timeit.repeat(prepare_request, number=number, repeat=5))
+    for name, auth in signers.items():
+        seconds = min(timeit.repeat(lambda: sign(auth), number=number, repeat=5)) - baseline
+        print(f"{name:>16}: {seconds / number * 1e6:7.1f} us/request")
+
+
+if __name__ == '__main__':
+    main()
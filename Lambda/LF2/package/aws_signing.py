@@ -0,0 +1,170 @@
+import datetime
+import functools
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict, namedtuple
+
+from requests_aws4auth import AWS4Auth, AWS4SigningKey
+from requests_aws4auth.exceptions import DateMismatchError
+
+
+# AWS4Auth re-derives the signing key (four chained HMACs) from its refreshable credentials
+# on every request and canonicalises the same OpenSearch paths and query strings over and
+# over. CachingAWS4Auth signs the same way but keeps the derived keys per
+# (secret key, date, region, service), only refreshes when the credentials actually change,
+# memoises the canonical path and query string, and hashes file-like bodies in chunks instead
+# of reading them into memory.
+#
+# One instance signs for every worker thread, so the access key, session token and signing key
+# are swapped together as one SigningState under a lock and each request reads that state once;
+# a request is never signed with the access key of one set of credentials and the key of another.
+
+SIGNING_KEY_CACHE_SIZE = 8
+CANONICAL_CACHE_SIZE = 256
+BODY_CHUNK_SIZE = 64 * 1024
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+SigningState = namedtuple('SigningState', ['access_id', 'session_token', 'signing_key'])
+
+_signing_keys = OrderedDict()
+_signing_keys_lock = threading.Lock()
+
+
+def get_signing_key(secret_key, region, service, date, store_secret_key=True):
+    key = (secret_key, region, service, date, store_secret_key)
+    with _signing_keys_lock:
+        signing_key = _signing_keys.get(key)
+        if signing_key is not None:
+            _signing_keys.move_to_end(key)
+            return signing_key
+    signing_key = AWS4SigningKey(secret_key, region, service, date, store_secret_key)
+    with _signing_keys_lock:
+        _signing_keys[key] = signing_key
+        while len(_signing_keys) > SIGNING_KEY_CACHE_SIZE:
+            _signing_keys.popitem(last=False)
+    return signing_key
+
+
+@functools.lru_cache(maxsize=CANONICAL_CACHE_SIZE)
+def _cano_path(service, path):
+    return AWS4Auth.amz_cano_path(_ServiceOnly(service), path)
+
+
+# amz_cano_path only reads the service from the instance it is called on
+class _ServiceOnly:
+    __slots__ = ('service',)
+
+    def __init__(self, service):
+        self.service = service
+
+
+class CachingAWS4Auth(AWS4Auth):
+
+    def __init__(self, *args, **kwargs):
+        self._credentials_lock = threading.Lock()
+        self._frozen_credentials = None
+        self._state = None
+        AWS4Auth.__init__(self, *args, **kwargs)
+        if not self.refreshable_credentials:
+            self._state = SigningState(self.access_id, self.session_token, self.signing_key)
+
+    def regenerate_signing_key(self, secret_key=None, region=None,
+                               service=None, date=None):
+        # same as AWS4Auth.regenerate_signing_key, with the derived key taken from the cache
+        if secret_key is None and (self.signing_key is None or self.signing_key.secret_key is None):
+            return AWS4Auth.regenerate_signing_key(self, secret_key, region, service, date)
+        secret_key = secret_key or self.signing_key.secret_key
+        region = region or self.region
+        service = service or self.service
+        date = date or self.date or datetime.datetime.utcnow().strftime('%Y%m%d')
+        store_secret_key = True if self.signing_key is None else self.signing_key.store_secret_key
+        self.signing_key = get_signing_key(secret_key, region, service, date, store_secret_key)
+        self.region = region
+        self.service = service
+        self.date = self.signing_key.date
+        with self._credentials_lock:
+            self._state = SigningState(getattr(self, 'access_id', None), getattr(self, 'session_token', None),
+                                       self.signing_key)
+
+    def refresh_credentials(self):
+        temporary_creds = self.refreshable_credentials.get_frozen_credentials()
+        with self._credentials_lock:
+            if temporary_creds == self._frozen_credentials:
+                return
+            date = self.date or datetime.datetime.utcnow().strftime('%Y%m%d')
+            signing_key = get_signing_key(temporary_creds.secret_key, self.region, self.service, date)
+            self._state = SigningState(temporary_creds.access_key, temporary_creds.token, signing_key)
+            self.access_id, self.session_token, self.signing_key = self._state
+            self.date = signing_key.date
+            self._frozen_credentials = temporary_creds
+
+    # the key of state for another scope date, which replaces it unless the credentials changed
+    # in the meantime
+    def dated_state(self, state, date):
+        if state.signing_key.secret_key is None:
+            raise DateMismatchError
+        old_key = state.signing_key
+        state = state._replace(signing_key=get_signing_key(old_key.secret_key, old_key.region, old_key.service,
+                                                           date, old_key.store_secret_key))
+        with self._credentials_lock:
+            if self._state.signing_key is old_key:
+                self._state = state
+                self.signing_key = state.signing_key
+                self.date = date
+        return state
+
+    def amz_cano_path(self, path):
+        return _cano_path(self.service, path)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CANONICAL_CACHE_SIZE)
+    def amz_cano_querystring(qs):
+        return AWS4Auth.amz_cano_querystring(qs)
+
+    def hash_body(self, req):
+        body = getattr(req, 'body', None)
+        if body is None:
+            content = getattr(req, 'content', None)
+            return EMPTY_SHA256 if content is None else hashlib.sha256(content).hexdigest()
+        if hasattr(body, 'read'):
+            if hasattr(body, 'seekable') and body.seekable():
+                start = body.tell()
+                hsh = hashlib.sha256()
+                for chunk in iter(lambda: body.read(BODY_CHUNK_SIZE), b''):
+                    hsh.update(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                body.seek(start)
+                return hsh.hexdigest()
+            req.body = body.read()
+        self.encode_body(req)
+        return hashlib.sha256(req.body).hexdigest()
+
+    def __call__(self, req):
+        # AWS4Auth.__call__ with hash_body in place of reading and hashing the body inline,
+        # signing with one snapshot of the credentials
+        if self.refreshable_credentials:
+            self.refresh_credentials()
+        state = self._state
+        req_date = self.get_request_date(req)
+        if req_date is None:
+            if 'date' in req.headers: del req.headers['date']
+            if 'x-amz-date' in req.headers: del req.headers['x-amz-date']
+            now = datetime.datetime.utcnow()
+            req_date = now.date()
+            req.headers['x-amz-date'] = now.strftime('%Y%m%dT%H%M%SZ')
+        req_scope_date = req_date.strftime('%Y%m%d')
+        if req_scope_date != state.signing_key.date:
+            state = self.dated_state(state, req_scope_date)
+
+        req.headers['x-amz-content-sha256'] = self.hash_body(req)
+        if state.session_token:
+            req.headers['x-amz-security-token'] = state.session_token
+
+        cano_headers, signed_headers = self.get_canonical_headers(req, self.include_hdrs)
+        cano_req = self.get_canonical_request(req, cano_headers, signed_headers)
+        sig_string = self.get_sig_string(req, cano_req, state.signing_key.scope).encode('utf-8')
+        sig = hmac.new(state.signing_key.key, sig_string, hashlib.sha256).hexdigest()
+        req.headers['Authorization'] = (
+            'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+                state.access_id, state.signing_key.scope, signed_headers, sig))
+        return req
@@ -0,0 +1 @@
+../../dining_request.py
\ No newline at end of file
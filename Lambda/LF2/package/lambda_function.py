@@ -1,40 +1,106 @@
-import json
 import os
 
 import boto3
-from opensearchpy import OpenSearch, RequestsHttpConnection
-from requests_aws4auth import AWS4Auth
-import requests
+from boto3.dynamodb.types import TypeDeserializer
+from dining_request import decode_request
+from lazy_imports import lazy_import
 import logging
 import time
 import random
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# both pull in requests, urllib3, charset_normalizer and idna, see get_opensearch; they are first
+# touched under _opensearch_lock since LazyLoader is not thread-safe before Python 3.12
+opensearchpy = lazy_import('opensearchpy')
+aws_signing = lazy_import('aws_signing')
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 REGION = 'us-east-1'
+NUM_SUGGESTIONS = 5
+# draw this many candidates per suggestion so that duplicate names rarely need a second round trip
+OVERSAMPLE_FACTOR = 3
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+BATCH_GET_RETRIES = 5
+# upper bound on detail lookups per message, reached only when the sample has many duplicate names
+MAX_LOOKUPS = 50
+# candidate pools are cached per cuisine for POOL_CACHE_TTL seconds, 0 disables the cache and
+# samples every message on the OpenSearch side instead
+POOL_CACHE_TTL = int(os.getenv('POOL_CACHE_TTL', '300'))
+POOL_CACHE_SIZE = 16
+# a pool is read POOL_PAGE_SIZE hits at a time, up to MAX_POOL_SIZE restaurants per cuisine
+POOL_PAGE_SIZE = 1000
+MAX_POOL_SIZE = int(os.getenv('MAX_POOL_SIZE', '20000'))
+# the index version marker is written by Yelp/GetAndStoreRestaurant.py on every ingest
+INDEX_VERSION_INDEX = 'restaurants_meta'
+INDEX_VERSION_CHECK_INTERVAL = 60
+# restaurant details kept across messages, bounded by entry count and approximate size in bytes
+DETAIL_CACHE_SIZE = int(os.getenv('DETAIL_CACHE_SIZE', '5000'))
+# the verified SES identities are listed at most once per VERIFIED_CACHE_TTL seconds, or once per
+# VERIFIED_MIN_REFRESH seconds when an address is not in the cached list
+VERIFIED_CACHE_TTL = 300
+VERIFIED_MIN_REFRESH = 10
+# messages for unverified recipients are hidden for this long instead of blocking a worker
+UNVERIFIED_RETRY_DELAY = int(os.getenv('UNVERIFIED_RETRY_DELAY', '60'))
+VERIFICATION_RESEND_INTERVAL = 3600
+DETAIL_CACHE_BYTES = int(os.getenv('DETAIL_CACHE_BYTES', str(8 * 1024 * 1024)))
+# number of SQS messages worked on at once, 1 processes the batch sequentially
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '10'))
 
 sqs = boto3.client('sqs', region_name = REGION,
                        aws_access_key_id = os.getenv('KEY_ID'),
                        aws_secret_access_key = os.getenv('SECRET_KEY'))
 
 
-session = boto3.Session(region_name='us-east-1',
+# boto3 clients are thread-safe but resources are not, so the worker threads share one low-level
+# client and deserialize its typed attribute values themselves
+# ref: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/resources.html#multithreading-or-multiprocessing-with-resources
+RESTAURANT_TABLE = 'yelp-restaurants'
+dynamodb = boto3.client('dynamodb', region_name=REGION,
                         aws_access_key_id=os.getenv('KEY_ID'),
                         aws_secret_access_key=os.getenv('SECRET_KEY'))
-dynamodb = session.resource('dynamodb')
-table = dynamodb.Table('yelp-restaurants')
+deserializer = TypeDeserializer()
 
 ses = boto3.client("ses", region_name=REGION,
                    aws_access_key_id=os.getenv('KEY_ID'),
                    aws_secret_access_key=os.getenv('SECRET_KEY'))
 
+# one signed client per container, the connection pool keeps TLS connections alive across
+# messages and invocations and the signer only re-derives its key when the credentials change.
+# It is built on first use, so invocations that find the queue empty never import opensearchpy
+# ref: https://opensearch.org/docs/latest/clients/python-low-level/#connecting-to-amazon-opensearch-service
+_opensearch = None
+_opensearch_lock = threading.Lock()
+
+def get_opensearch():
+    global _opensearch
+    with _opensearch_lock:
+        if _opensearch is None:
+            # signs like AWS4Auth but caches the derived signing key, see aws_signing
+            awsauth = aws_signing.CachingAWS4Auth(region=REGION,
+                                                  service='es',
+                                                  refreshable_credentials=boto3.Session().get_credentials())
+            _opensearch = opensearchpy.OpenSearch(hosts=[os.getenv('OS_HOST')],
+                                                  http_auth=awsauth,
+                                                  use_ssl=True,
+                                                  verify_certs=True,
+                                                  connection_class=opensearchpy.RequestsHttpConnection,
+                                                  pool_maxsize=MAX_WORKERS)
+    return _opensearch
+
 
 # ref: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/sqs-example-sending-receiving-msgs.html
 def receive_sqs_message():
     response = sqs.receive_message(
         QueueUrl=os.getenv('QUEUE_URL'),
         AttributeNames=['All'],
+        # requests are encoded in the body now, the attributes are only read for messages
+        # sent by older producers
         MessageAttributeNames=[
             'cuisine', 'date', 'location', 'party_size', 'email', 'time'
         ],
@@ -44,61 +110,237 @@ def receive_sqs_message():
     # [{'MessageId': 'f1285163-d0d9-4d39-97de-a80763a4c1e5', 'ReceiptHandle': 'AQEBYq6q7UFSlcAE+zWM/nZzmk5Kmb0wC9xxXeOhOfarFi/byJfPNNWNOxRCWluwxxH0sEnxtbUhRYOU3uhW27urJbimrdkWllGJr3qJMjtisRuRo5VGokqooHNCpq/s7D5vS1Q9OHmckxpLL6wpEFrMmecFpNhcdtWDsB18T4oRYp6H46Q5xiYRqgQy69kwBYTTr1Cy3twViIFVrW4Xe8hMjRVQRvWoH+4CS8OHs0KvEij+5F36oVqGLMCv2DrijR+pK5+ImXHU3vWHDw+TRnAEeUVzG8m6VNhzupSstq2eX+b0HPXIDKcrB8Ct8OcQJHp3sT2xiVNIKAOVsQLc+V2Q9V1OT482iWGHU0U5QtYRQaM84NRVhhnaXH1iHKnRNfbV5rvCKlCev/4Elkm4kc72ow==', 'MD5OfBody': '323f1e975e4258b28ef2b35350fc1a7c', 'Body': 'slots from the user', 'Attributes': {'SenderId': '267524565890', 'ApproximateFirstReceiveTimestamp': '1677272586781', 'ApproximateReceiveCount': '1', 'SentTimestamp': '1677205066582'}, 'MD5OfMessageAttributes': '229e079bd77d635892b59b82ebd97403', 'MessageAttributes': {'cuisine': {'StringValue': 'japanese', 'DataType': 'String'}, 'date': {'StringValue': '2023-02-22', 'DataType': 'String'}, 'location': {'StringValue': 'manhattan', 'DataType': 'String'}, 'party_size': {'StringValue': '4', 'DataType': 'String'}, 'phone_number': {'StringValue': '6469459688', 'DataType': 'String'}, 'time': {'StringValue': '16:00', 'DataType': 'String'}}}]
     return response.get('Messages', [])
 
-def delete_sqs_message(receipt_handle):
-    sqs.delete_message(
-        QueueUrl=os.getenv('QUEUE_URL'),
-        ReceiptHandle=receipt_handle
-    )
+# DeleteMessageBatch accepts at most 10 entries per request
+def delete_sqs_messages(receipt_handles):
+    for start in range(0, len(receipt_handles), 10):
+        entries = [{'Id': str(i), 'ReceiptHandle': handle}
+                   for i, handle in enumerate(receipt_handles[start:start + 10])]
+        response = sqs.delete_message_batch(
+            QueueUrl=os.getenv('QUEUE_URL'),
+            Entries=entries
+        )
+        for failed in response.get('Failed', []):
+            logger.warning(f"Failed to delete message: {failed}")
 
 # ref: https://docs.aws.amazon.com/opensearch-service/latest/developerguide/search-example.html
-def find_res_opensearch(index, cuisine):
-    service = 'es'
-    awsauth = get_awsauth(REGION, service)
-    url = os.getenv('OS_HOST') + '/' + index + '/_search'
+# with sample_size set, OpenSearch returns a random sample of that many hits instead of every hit
+# for the cuisine; either way the hits carry only restaurantID
+def find_res_opensearch(index, cuisine, sample_size=None, seed=None):
+    # cuisines is a keyword array with every cuisine and Yelp category of the restaurant,
+    # a term filter on it is cached by OpenSearch and needs no query parsing
+    match = {
+        "bool": {
+            "filter": [
+                {"term": {"cuisines": cuisine.lower()}}
+            ]
+        }
+    }
+    if sample_size is None:
+        return find_all_res_opensearch(index, match)
+
+    # ref: https://opensearch.org/docs/latest/query-dsl/compound/function-score/#the-random-score-function
     query = {
-        "size": 1000,
+        "size": sample_size,
+        "_source": ["restaurantID"],
         "query": {
-            "query_string": {
-                "default_field": "cuisine",
-                "query": cuisine.lower()
+            "function_score": {
+                "query": match,
+                "random_score": {
+                    "seed": random.getrandbits(31) if seed is None else seed,
+                    "field": "_seq_no"
+                },
+                "boost_mode": "replace"
             }
         }
     }
-    headers = {"Content-Type": "application/json"}
-    r = requests.get(url, auth=awsauth, headers=headers, data=json.dumps(query))
-    r = json.loads(r.text)
-    response = []
-    for res in r['hits']['hits']:
-        response.append(res['_source'])
+    r = get_opensearch().search(index=index, body=query)
+    # [{'restaurantID': 'axqp3pGJXnTLgq2QrPyDyQ'}, {'restaurantID': 'kesYSgOJW5krU6L8n9qQ4Q'}, {'restaurantID': '9QK3vhI04Q8ylqk49C3JcQ'}]
+    return [res['_source'] for res in r['hits']['hits']]
 
-    # [{'restaurantID': 'axqp3pGJXnTLgq2QrPyDyQ', 'cuisine': 'japanese'}, {'restaurantID': 'kesYSgOJW5krU6L8n9qQ4Q', 'cuisine': 'japanese'}, {'restaurantID': '9QK3vhI04Q8ylqk49C3JcQ', 'cuisine': 'japanese'}, {'restaurantID': 'i8ejDDR4COtukAAA1Ls5fw', 'cuisine': 'japanese'}, {'restaurantID': 'ipAsHykRvgJzpx5hD8vTJw', 'cuisine': 'japanese'}]
+# pages through every hit with search_after, sorted on restaurantID, so a cuisine with more
+# restaurants than fit in one page is read completely
+# ref: https://opensearch.org/docs/latest/search-plugins/searching-data/paginate/#the-search_after-parameter
+def find_all_res_opensearch(index, match):
+    query = {
+        "size": POOL_PAGE_SIZE,
+        "_source": ["restaurantID"],
+        "query": match,
+        "sort": [{"restaurantID": "asc"}],
+        "track_total_hits": True
+    }
+    response = []
+    while len(response) < MAX_POOL_SIZE:
+        r = get_opensearch().search(index=index, body=query)
+        hits = r['hits']['hits']
+        response.extend(res['_source'] for res in hits)
+        if len(hits) < POOL_PAGE_SIZE:
+            break
+        query['search_after'] = hits[-1]['sort']
+    response = response[:MAX_POOL_SIZE]
+    total = r['hits']['total']['value']
+    if total > len(response):
+        logger.warning(f"Read {len(response)} of {total} restaurants from {index}, raise MAX_POOL_SIZE")
     return response
 
 
 
-def search_dynamoDB(key):
-    return table.get_item(Key={'businessID':key})
+# (index, cuisine) -> (expires_at, index_version, restaurant IDs), least recently used first
+_pool_cache = OrderedDict()
+_pool_lock = threading.Lock()
+_index_version = {'value': None, 'checked_at': float('-inf')}
 
-def get_awsauth(region, service):
-    cred = boto3.Session().get_credentials()
-    return AWS4Auth(cred.access_key,
-                    cred.secret_key,
-                    region,
-                    service,
-                    session_token=cred.token)
+def get_index_version():
+    with _pool_lock:
+        if time.monotonic() - _index_version['checked_at'] < INDEX_VERSION_CHECK_INTERVAL:
+            return _index_version['value']
+    try:
+        version = get_opensearch().get(index=INDEX_VERSION_INDEX, id='version')['_source'].get('version')
+    except opensearchpy.NotFoundError:
+        version = None
+    except opensearchpy.TransportError:
+        logger.exception('Could not read the index version marker')
+        version = None
+    with _pool_lock:
+        _index_version['value'] = version
+        _index_version['checked_at'] = time.monotonic()
+    return version
+
+def get_candidate_pool(index, cuisine):
+    key = (index, cuisine.lower())
+    version = get_index_version()
+    with _pool_lock:
+        entry = _pool_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+            _pool_cache.move_to_end(key)
+            return entry[2]
+    pool = tuple(res['restaurantID'] for res in find_res_opensearch(index, cuisine))
+    with _pool_lock:
+        _pool_cache[key] = (time.monotonic() + POOL_CACHE_TTL, version, pool)
+        _pool_cache.move_to_end(key)
+        while len(_pool_cache) > POOL_CACHE_SIZE:
+            _pool_cache.popitem(last=False)
+    return pool
+
+
+
+# only the fields build_message needs
+class RestaurantDetails:
+    __slots__ = ('name', 'display_address', 'size')
+
+    def __init__(self, name, display_address):
+        self.name = name
+        self.display_address = tuple(display_address)
+        self.size = (sys.getsizeof(self) + sys.getsizeof(name) + sys.getsizeof(self.display_address)
+                     + sum(sys.getsizeof(line) for line in self.display_address))
+
+# businessID -> RestaurantDetails, least recently used first
+_detail_cache = OrderedDict()
+_detail_lock = threading.Lock()
+detail_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+def get_restaurant_details(keys):
+    details = {}
+    with _detail_lock:
+        for key in keys:
+            record = _detail_cache.get(key)
+            if record is None:
+                continue
+            _detail_cache.move_to_end(key)
+            details[key] = record
+        detail_cache_stats['hits'] += len(details)
+        detail_cache_stats['misses'] += len(keys) - len(details)
+    missing = [key for key in keys if key not in details]
+    if not missing:
+        return details
+    fetched = {key: RestaurantDetails(item['name'], item['location']['display_address'])
+               for key, item in batch_search_dynamoDB(missing).items()}
+    details.update(fetched)
+    with _detail_lock:
+        for key, record in fetched.items():
+            old = _detail_cache.pop(key, None)
+            if old is not None:
+                detail_cache_stats['bytes'] -= old.size
+            _detail_cache[key] = record
+            detail_cache_stats['bytes'] += record.size
+        while _detail_cache and (len(_detail_cache) > DETAIL_CACHE_SIZE
+                                 or detail_cache_stats['bytes'] > DETAIL_CACHE_BYTES):
+            _, evicted = _detail_cache.popitem(last=False)
+            detail_cache_stats['bytes'] -= evicted.size
+            detail_cache_stats['evictions'] += 1
+    return details
+
+
+
+# ref: https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_BatchGetItem.html
+def batch_search_dynamoDB(keys):
+    # name and location are DynamoDB reserved words, hence the placeholders
+    projection = {
+        'ProjectionExpression': 'businessID, #n, #l.display_address',
+        'ExpressionAttributeNames': {'#n': 'name', '#l': 'location'}
+    }
+    keys = list(dict.fromkeys(keys))
+    details = {}
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {
+            RESTAURANT_TABLE: dict(Keys=[{'businessID': {'S': key}}
+                                         for key in keys[start:start + BATCH_GET_LIMIT]],
+                                   **projection)
+        }
+        for attempt in range(BATCH_GET_RETRIES):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(RESTAURANT_TABLE, []):
+                item = {name: deserializer.deserialize(value) for name, value in item.items()}
+                details[item['businessID']] = item
+            request_items = response.get('UnprocessedKeys', {})
+            if not request_items:
+                break
+            # throttled keys come back unprocessed, back off before retrying them
+            time.sleep(0.05 * 2 ** attempt)
+        else:
+            logger.warning(f"Giving up on {len(request_items[RESTAURANT_TABLE]['Keys'])} unprocessed keys")
+    return details
+
+class RecipientNotVerified(Exception):
+    pass
+
+_verified_lock = threading.Lock()
+_verified = {'emails': frozenset(), 'listed_at': float('-inf')}
+# email -> time the last verification request was sent from this container
+_pending_verification = {}
+
+def is_verified_email(email):
+    with _verified_lock:
+        age = time.monotonic() - _verified['listed_at']
+        if age < VERIFIED_CACHE_TTL and (email in _verified['emails'] or age < VERIFIED_MIN_REFRESH):
+            return email in _verified['emails']
+        _verified['emails'] = frozenset(ses.list_verified_email_addresses()['VerifiedEmailAddresses'])
+        _verified['listed_at'] = time.monotonic()
+        return email in _verified['emails']
 
 # https://www.learnaws.org/2020/12/18/aws-ses-boto3-guide/
 def verify_email_identity(email):
+    with _verified_lock:
+        sent_at = _pending_verification.get(email)
+        if sent_at is not None and time.monotonic() - sent_at < VERIFICATION_RESEND_INTERVAL:
+            return
+        _pending_verification[email] = time.monotonic()
     response = ses.verify_email_identity(
         EmailAddress=email
     )
     print(response)
 
+# ref: https://docs.aws.amazon.com/AWSSimpleQueueService/latest/SQSDeveloperGuide/sqs-visibility-timeout.html
+def postpone_sqs_message(receipt_handle, delay):
+    sqs.change_message_visibility(
+        QueueUrl=os.getenv('QUEUE_URL'),
+        ReceiptHandle=receipt_handle,
+        VisibilityTimeout=delay
+    )
+
 def send_email(email, message):
-    if email not in ses.list_verified_email_addresses()['VerifiedEmailAddresses']:
+    if not is_verified_email(email):
         verify_email_identity(email)
-        while email not in ses.list_verified_email_addresses()['VerifiedEmailAddresses']:
-            time.sleep(10)
+        raise RecipientNotVerified(email)
 
     ses.send_email(
         Destination={
@@ -136,37 +378,118 @@ def build_message(all_details, cuisine, party_size, date, time, location):
     return message
 
 
-def lambda_handler(event, context):
-    messages = receive_sqs_message()
-    for msg in messages:
-        cuisine = msg['MessageAttributes']['cuisine']['StringValue']
-        party_size = msg['MessageAttributes']['party_size']['StringValue']
-        date = msg['MessageAttributes']['date']['StringValue']
-        time = msg['MessageAttributes']['time']['StringValue']
-        location = msg['MessageAttributes']['location']['StringValue']
-        email = msg['MessageAttributes']['email']['StringValue']
+# walks the candidates once in random order, fetching their details one batch at a time, until k
+# distinct names are found or MAX_LOOKUPS candidates have been looked up
+def select_restaurants(candidate_ids, k=NUM_SUGGESTIONS, max_lookups=MAX_LOOKUPS):
+    candidate_ids = list(dict.fromkeys(candidate_ids))
+    candidate_ids = random.sample(candidate_ids, min(len(candidate_ids), max_lookups))
+    chunk_size = k * OVERSAMPLE_FACTOR
+    names = set()
+    all_details = []
+    for start in range(0, len(candidate_ids), chunk_size):
+        chunk = candidate_ids[start:start + chunk_size]
+        details = get_restaurant_details(chunk)
+        for key in chunk:
+            res_details = details.get(key)
+            if res_details is None or res_details.name in names:
+                continue
+            all_details.append({
+                'name': res_details.name,
+                'location': res_details.display_address})
+            names.add(res_details.name)
+            if len(all_details) == k:
+                return all_details
+    return all_details
+
 
+def process_message(msg):
+    request_id, slots = decode_request(msg['Body'], msg.get('MessageAttributes'))
+    logger.debug(f"Processing request {request_id} from message {msg['MessageId']}")
+    cuisine = slots['cuisine']
+    party_size = slots['party_size']
+    date = slots['date']
+    time = slots['time']
+    location = slots['location']
+    email = slots['email']
+
+    if POOL_CACHE_TTL > 0:
+        candidate_ids = get_candidate_pool('restaurants', cuisine)
+    else:
         results = find_res_opensearch('restaurants',
-                                      cuisine)
-        names = set()
-        all_details = []
-        while len(all_details) < 5:
-            i = random.randint(0, len(results))
-            res = results[i]
-            res_details = search_dynamoDB(res['restaurantID'])
-            res_details = res_details['Item']
-            if res_details['name'] not in names:
-                res_dict = {
-                    'name': res_details['name'],
-                    'location': res_details['location']['display_address']}
-                all_details.append(res_dict)
-                names.add(res_details['name'])
-
-
-        response_message = build_message(all_details, cuisine,party_size,date,time,location)
-        send_email(email, response_message)
-
-        delete_sqs_message(msg['ReceiptHandle'])
+                                      cuisine,
+                                      sample_size=MAX_LOOKUPS,
+                                      seed=msg['MessageId'])
+        candidate_ids = [res['restaurantID'] for res in results]
+    if not candidate_ids:
+        # the restaurants alias must point to an index built by Yelp/GetAndStoreRestaurant.py,
+        # indices without the cuisines field match nothing
+        logger.warning(f"No restaurants found for cuisine {cuisine}")
+    all_details = select_restaurants(candidate_ids)
+
+    response_message = build_message(all_details, cuisine,party_size,date,time,location)
+    send_email(email, response_message)
+
+
+# SQS event source mapping records use camelCase keys, convert them to the ReceiveMessage shape
+# ref: https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#example-standard-queue-message-event
+def record_to_message(record):
+    return {
+        'MessageId': record['messageId'],
+        'ReceiptHandle': record['receiptHandle'],
+        'Body': record['body'],
+        'Attributes': record.get('attributes', {}),
+        'MessageAttributes': {
+            name: {'StringValue': attr.get('stringValue'), 'DataType': attr['dataType']}
+            for name, attr in record.get('messageAttributes', {}).items()
+        }
+    }
+
+# returns the messages that could not be processed, the rest of the batch is unaffected by them
+def process_messages(messages):
+    failed = []
+    if not messages:
+        return failed
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(messages)))) as executor:
+        futures = {executor.submit(process_message, msg): msg for msg in messages}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except RecipientNotVerified as e:
+                # the message becomes visible again once the recipient had time to verify
+                logger.info(f"Postponing message {futures[future]['MessageId']}, {e} is not verified yet")
+                failed.append(futures[future])
+                try:
+                    postpone_sqs_message(futures[future]['ReceiptHandle'], UNVERIFIED_RETRY_DELAY)
+                except Exception:
+                    logger.exception(f"Failed to postpone message {futures[future]['MessageId']}")
+            except Exception:
+                logger.exception(f"Failed to process message {futures[future]['MessageId']}")
+                failed.append(futures[future])
+    logger.debug(f"Detail cache: {detail_cache_stats}")
+    return failed
+
+# ref: https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#services-sqs-batchfailurereporting
+def batch_item_failures(failed):
+    return {'batchItemFailures': [{'itemIdentifier': msg['MessageId']} for msg in failed]}
+
+
+# entry point for an SQS event source mapping with ReportBatchItemFailures enabled,
+# Lambda deletes the messages that are not reported as failed
+def sqs_event_handler(event, context):
+    messages = [record_to_message(record) for record in event['Records']]
+    return batch_item_failures(process_messages(messages))
+
+
+# polling entry point, kept for scheduled invocations
+def lambda_handler(event, context):
+    if event and 'Records' in event:
+        return sqs_event_handler(event, context)
+    messages = receive_sqs_message()
+    failed = process_messages(messages)
+    # failed messages stay on the queue and are retried after their visibility timeout
+    failed_ids = {msg['MessageId'] for msg in failed}
+    delete_sqs_messages([msg['ReceiptHandle'] for msg in messages if msg['MessageId'] not in failed_ids])
+    return batch_item_failures(failed)
 
 
 # if __name__ == '__main__':
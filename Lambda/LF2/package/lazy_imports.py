@@ -0,0 +1,22 @@
+import importlib.util
+import sys
+
+
+# Modules registered here are created right away but only executed on first attribute access,
+# so a cold start that never talks to OpenSearch does not pay for importing opensearchpy,
+# requests, urllib3, charset_normalizer and idna.
+# ref: https://docs.python.org/3/library/importlib.html#implementing-lazy-imports
+
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Import-time profiler for the LF2 deployment package. Runs the import in a fresh interpreter with
+# -X importtime and adds up the self time of every module per top-level package, so the output
+# can be saved and compared between builds.
+# Usage:
+#   python profile_imports.py                              import lambda_function from package/
+#   python profile_imports.py --module opensearchpy --save before.json
+#   python profile_imports.py --diff before.json
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'package')
+
+
+def profile(module, cwd=PACKAGE_DIR, python=sys.executable):
+    # bytecode writing is disabled so every run measures the same, uncached imports
+    result = subprocess.run([python, '-X', 'importtime', '-B', '-c', f"import {module}"],
+                            cwd=cwd, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = {'self_us': int(self_us), 'cumulative_us': int(cumulative_us)}
+    return modules
+
+
+# sums the self time of the modules per top-level package, which is what importing it costs
+def aggregate(modules):
+    packages = {}
+    for name, times in modules.items():
+        package = packages.setdefault(name.split('.')[0], {'self_us': 0, 'modules': 0})
+        package['self_us'] += times['self_us']
+        package['modules'] += 1
+    return packages
+
+
+def report(packages, limit):
+    total = sum(package['self_us'] for package in packages.values())
+    print(f"{'package':<30}{'modules':>8}{'ms':>10}{'share':>8}")
+    for name, package in sorted(packages.items(), key=lambda item: -item[1]['self_us'])[:limit]:
+        print(f"{name:<30}{package['modules']:>8}{package['self_us'] / 1000:>10.1f}"
+              f"{package['self_us'] / total:>8.1%}")
+    print(f"{'total':<30}{sum(p['modules'] for p in packages.values()):>8}{total / 1000:>10.1f}")
+
+
+def diff(before, after, limit):
+    names = set(before) | set(after)
+    changes = {name: after.get(name, {}).get('self_us', 0) - before.get(name, {}).get('self_us', 0)
+               for name in names}
+    print(f"{'package':<30}{'before ms':>10}{'after ms':>10}{'delta ms':>10}")
+    for name in sorted(names, key=lambda name: -abs(changes[name]))[:limit]:
+        print(f"{name:<30}{before.get(name, {}).get('self_us', 0) / 1000:>10.1f}"
+              f"{after.get(name, {}).get('self_us', 0) / 1000:>10.1f}{changes[name] / 1000:>+10.1f}")
+    print(f"{'total':<30}{'':>20}{sum(changes.values()) / 1000:>+10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate -X importtime per top-level package.')
+    parser.add_argument('--module', default='lambda_function')
+    parser.add_argument('--save', metavar='PATH', help='write the per-package times as JSON')
+    parser.add_argument('--diff', metavar='PATH', help='compare against times saved with --save')
+    parser.add_argument('--limit', type=int, default=25)
+    args = parser.parse_args()
+
+    packages = aggregate(profile(args.module))
+    if args.diff:
+        with open(args.diff) as infile:
+            diff(json.load(infile), packages, args.limit)
+    else:
+        report(packages, args.limit)
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(packages, outfile, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
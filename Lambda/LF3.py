@@ -1,33 +1,47 @@
 import json
 import boto3
+import hashlib
+import datetime
+import os
 import time
+from botocore.exceptions import ClientError
+
+from dining_request import encode_request, repeat_search_slots
+from dining_validation import TIMEZONE, validate_slots
 
 # Define the client to interact with Lex
 client = boto3.client('lexv2-runtime')
 
+sqs = boto3.client('sqs', region_name = 'us-east-1',
+                   aws_access_key_id = os.getenv('KEY_ID'),
+                   aws_secret_access_key = os.getenv('SECRET_KEY'))
+
+dynamodb = boto3.resource('dynamodb')
+last_search = dynamodb.Table('last_search')
+
+# repeat_status of a repeated search on the user's last_search item
+REPEAT_PENDING = 'pending'
+REPEAT_SENT = 'sent'
+REPEAT_INVALID = 'invalid'
+REPEAT_FAILED = 'failed'
+
+# the replay gets a Lex session of its own per user, separate from the user's chat session in LF0
+def get_session_id(user_email):
+    return 'repeat-' + hashlib.sha256(user_email.lower().encode('utf-8')).hexdigest()[:32]
+
 # return the response from lex
-def get_response(msg):
+def get_response(msg, session_id):
     response = client.recognize_text(
     botId='XYWRSPCNFB', # MODIFY HERE
     # botAliasId='MAUQZ0D8KP',  # version 2
     botAliasId='TSTALIASID', # draft version
     localeId='en_US',
-    sessionId='test_session',
+    sessionId=session_id,
     text=msg)
     return response
 
-def lambda_handler(event, context):
-    # TODO implement
-    print(event)
-    
-    # extract information from event
-    old_location = event["old_location"]
-    old_category = event["old_category"]
-    user_email = event["user_email"]
-    print(old_location)
-    print(old_category)
-    print(user_email)
-    
+# replays the whole conversation through Lex so that LF1 pushes the request to SQS
+def replay_last_search(user_email, old_location, old_category):
     # constructing messages here
     msg_from_lf0 = ["I need some restaurant suggestions."]
     msg_from_lf0.append(user_email)
@@ -36,24 +50,134 @@ def lambda_handler(event, context):
     msg_from_lf0.append("Two")
     msg_from_lf0.append("Tomorrow")
     msg_from_lf0.append("7pm")
-    
+
     print(msg_from_lf0)
+    session_id = get_session_id(user_email)
     # get response from lex
     for i in range(0,7): # set timeout for LF3 to 20sec (default 3sec is not enough)
         # time.sleep(2)
-        response = get_response(msg_from_lf0[i])
-    
+        response = get_response(msg_from_lf0[i], session_id)
+
     msg_from_lex = response.get('messages', [])
     session_intent = response.get('interpretations',[])[0]['intent']
-    
+
     if msg_from_lex:
         response_from_lex=''
         for message in msg_from_lex:
             response_from_lex +=  message['content']+ ' '
-            
+
         print(f"Message from Chatbot: {response_from_lex}")
-        
-        
+    return True
+
+# LF0 invokes this function asynchronously and Lambda retries failed asynchronous invocations,
+# so the request id is claimed on the user's last_search item before anything is enqueued; a
+# retry finds it claimed and does not send the request again, unless the earlier attempt failed
+# before reaching SQS
+def claim_request(user_email, request_id):
+    try:
+        last_search.update_item(
+            Key={'user_email': user_email},
+            UpdateExpression='SET repeat_request_id = :request_id, repeat_status = :pending',
+            ConditionExpression='attribute_not_exists(repeat_request_id) OR repeat_request_id <> :request_id '
+                                'OR repeat_status = :failed',
+            ExpressionAttributeValues={':request_id': request_id, ':pending': REPEAT_PENDING,
+                                       ':failed': REPEAT_FAILED}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+# the status is bookkeeping only, failing to write it must not fail an invocation whose request
+# was already sent; a newer request of the same user is never overwritten
+def record_status(user_email, request_id, status):
+    try:
+        last_search.update_item(
+            Key={'user_email': user_email},
+            UpdateExpression='SET repeat_status = :status',
+            ConditionExpression='repeat_request_id = :request_id',
+            ExpressionAttributeValues={':request_id': request_id, ':status': status}
+        )
+    except ClientError as e:
+        print(f"Could not record status {status} of request {request_id}: {e}")
+
+# returns the status of the user's latest repeated search, or of request_id when given
+def get_status(user_email, request_id=None):
+    item = last_search.get_item(Key={'user_email': user_email}).get('Item', {})
+    if request_id is not None and item.get('repeat_request_id') != request_id:
+        return None
+    return item.get('repeat_status')
+
+# builds the same request LF1 would push at the end of the replayed conversation and
+# enqueues it directly, one SQS call instead of 7 Lex turns
+def enqueue_last_search(user_email, old_location, old_category, request_id=None):
+    if request_id is not None and not claim_request(user_email, request_id):
+        status = get_status(user_email, request_id)
+        print(f"Request {request_id} was already handled: {status}")
+        return status != REPEAT_INVALID
+
+    now = datetime.datetime.now(TIMEZONE)
+    slots = repeat_search_slots(old_location, old_category, user_email, now.date())
+    validation_result = validate_slots(slots, now=now)
+    if not validation_result['isValid']:
+        print(f"Last search is no longer valid: {validation_result}")
+        if request_id is not None:
+            record_status(user_email, request_id, REPEAT_INVALID)
+        return False
+
+    message_body = encode_request(slots, request_id=request_id)
+    try:
+        response = sqs.send_message(QueueUrl=os.getenv('QUEUE_URL'),
+                                    MessageBody=message_body)
+    except Exception:
+        # lets the retry of this invocation claim the request again
+        if request_id is not None:
+            record_status(user_email, request_id, REPEAT_FAILED)
+        raise
+    print(response)
+    if request_id is not None:
+        record_status(user_email, request_id, REPEAT_SENT)
+    return True
+
+def lambda_handler(event, context):
+    print(event)
+
+    # "mode": "status" looks up the outcome of a repeated search LF0 handed over asynchronously
+    if event.get("mode") == "status":
+        status = get_status(event["user_email"], event.get("request_id"))
+        return {
+            'statusCode': 200 if status else 404,
+            'body': json.dumps({'request_id': event.get("request_id"), 'status': status})
+            }
+
+    # extract information from event
+    old_location = event["old_location"]
+    old_category = event["old_category"]
+    user_email = event["user_email"]
+    print(old_location)
+    print(old_category)
+    print(user_email)
+
+    # "mode": "lex" keeps the original conversation replay
+    if event.get("mode") == "lex":
+        request_id = event.get("request_id")
+        if request_id is not None and not claim_request(user_email, request_id):
+            print(f"Request {request_id} was already handled")
+            sent = True
+        else:
+            sent = replay_last_search(user_email, old_location, old_category)
+            if request_id is not None:
+                record_status(user_email, request_id, REPEAT_SENT if sent else REPEAT_INVALID)
+    else:
+        sent = enqueue_last_search(user_email, old_location, old_category, event.get("request_id"))
+
+    if not sent:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Your previous search can not be repeated, please start a new one.')
+            }
+
     return {
         'statusCode': 200,
         'body': json.dumps('A recommendation based on your previous search has been sent to your email!')
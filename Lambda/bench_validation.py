@@ -0,0 +1,25 @@
+import datetime
+import timeit
+
+from dining_validation import validate_dining_suggestions
+
+
+# Micro-benchmark for the slot validation that runs on every DialogCodeHook turn.
+# Usage: python bench_validation.py
+
+
+def main(number=100000):
+    tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+    cases = {
+        'first turn': (None, None, None, None, None, 'someone@example.com'),
+        'all slots': ('Manhattan', 'Japanese', '4', tomorrow, '19:00', 'someone@example.com'),
+        'invalid cuisine': ('Manhattan', 'Martian', None, None, None, 'someone@example.com'),
+        'invalid time': ('Manhattan', 'Japanese', '4', tomorrow, '7 pm', 'someone@example.com'),
+    }
+    for name, slots in cases.items():
+        seconds = min(timeit.repeat(lambda: validate_dining_suggestions(*slots), number=number, repeat=5))
+        print(f"{name:>16}: {seconds / number * 1e6:7.2f} us/call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from dining_request import SLOTS, encode_request, repeat_search_slots
+from dining_validation import CUISINE_TYPES, LOCATION_TYPES, TIMEZONE, validate_slots
+
+
+# Pushes many dining requests into the LF2 queue at once, for load tests and for replaying
+# the last search of every user in the last_search table.
+# Usage:
+#   python bulk_enqueue.py --synthetic 1000 --email someone@example.com
+#   python bulk_enqueue.py --last-search
+#   python bulk_enqueue.py --file requests.jsonl      (one JSON object of slots per line)
+
+REGION = 'us-east-1'
+# SendMessageBatch accepts at most 10 entries per request
+BATCH_SIZE = 10
+MAX_ATTEMPTS = 5
+
+sqs = boto3.client('sqs', region_name = REGION,
+                   aws_access_key_id = os.getenv('KEY_ID'),
+                   aws_secret_access_key = os.getenv('SECRET_KEY'))
+
+
+def synthetic_requests(count, email):
+    today = datetime.datetime.now(TIMEZONE).date()
+    locations = sorted(LOCATION_TYPES)
+    cuisines = sorted(CUISINE_TYPES)
+    for _ in range(count):
+        yield repeat_search_slots(random.choice(locations), random.choice(cuisines), email, today)
+
+
+def last_search_requests(table='last_search'):
+    today = datetime.datetime.now(TIMEZONE).date()
+    table = boto3.resource('dynamodb', region_name=REGION).Table(table)
+    kwargs = {}
+    while True:
+        response = table.scan(**kwargs)
+        for item in response['Items']:
+            yield repeat_search_slots(item['location'], item['category'], item['user_email'], today)
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def file_requests(path):
+    with open(path) as infile:
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
+
+
+# sends up to BATCH_SIZE bodies, resending the entries SQS reports as failed and the whole batch
+# when the request itself fails (throttling), and returns the number of bodies that could not be sent
+def send_batch(queue_url, bodies):
+    entries = {str(i): body for i, body in enumerate(bodies)}
+    rejected = 0
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            response = sqs.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': entry_id, 'MessageBody': body} for entry_id, body in entries.items()]
+            )
+        except ClientError as e:
+            print(f"Batch of {len(entries)} requests failed: {e}")
+            time.sleep(0.1 * 2 ** attempt)
+            continue
+        retry = {}
+        for entry in response.get('Failed', []):
+            # sender faults are malformed entries, resending them would not help
+            if entry['SenderFault']:
+                print(f"Rejected request: {entry}")
+                rejected += 1
+            else:
+                retry[entry['Id']] = entries[entry['Id']]
+        entries = retry
+        if not entries:
+            return rejected
+        time.sleep(0.1 * 2 ** attempt)
+    print(f"Giving up on {len(entries)} requests")
+    return rejected + len(entries)
+
+
+def send_requests(requests, queue_url, workers=4):
+    now = datetime.datetime.now(TIMEZONE)
+    bodies = []
+    invalid = 0
+    for slots in requests:
+        # validate_slots skips empty slots, a request needs all of them
+        if all(slots.get(slot) for slot in SLOTS) and validate_slots(slots, now=now)['isValid']:
+            bodies.append(encode_request(slots))
+        else:
+            invalid += 1
+    batches = [bodies[start:start + BATCH_SIZE] for start in range(0, len(bodies), BATCH_SIZE)]
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        failed = sum(executor.map(lambda batch: send_batch(queue_url, batch), batches))
+    elapsed = time.monotonic() - start
+
+    sent = len(bodies) - failed
+    return {
+        'sent': sent,
+        'failed': failed,
+        'invalid': invalid,
+        'batches': len(batches),
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(sent / elapsed, 1) if elapsed else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send dining requests to SQS in batches of 10.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--synthetic', type=int, metavar='COUNT', help='send COUNT random requests')
+    source.add_argument('--last-search', action='store_true', help='repeat the last search of every user')
+    source.add_argument('--file', help='JSON lines file with one request per line')
+    parser.add_argument('--email', help='recipient of the synthetic requests')
+    parser.add_argument('--queue-url', default=os.getenv('QUEUE_URL'))
+    parser.add_argument('--workers', type=int, default=4, help='number of batches sent in parallel')
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        if not args.email:
+            parser.error('--synthetic requires --email')
+        requests = synthetic_requests(args.synthetic, args.email)
+    elif args.last_search:
+        requests = last_search_requests()
+    else:
+        requests = file_requests(args.file)
+    print(send_requests(requests, args.queue_url, args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import datetime
+import json
+import uuid
+
+
+# SQS message layout of a dining request, shared by the producers (LF1 and LF3's
+# repeat-last-search path) and the consumer (LF2), and bundled into the deployment
+# package of each of them.
+#
+# The body carries a versioned envelope {"v": version, "id": request id, "s": slot values in
+# SLOTS order} encoded as compact JSON. Messages from older producers have the constant
+# MESSAGE_BODY and their slots in message attributes.
+
+SLOTS = ('location', 'cuisine', 'party_size', 'date', 'time', 'email')
+SCHEMA_VERSION = 1
+MESSAGE_BODY = 'slots from the user'
+
+
+# a repeated search asks for the same place and cuisine as the user's last one,
+# for a party of two tomorrow evening
+REPEAT_PARTY_SIZE = '2'
+REPEAT_TIME = '19:00'
+
+
+class InvalidDiningRequest(ValueError):
+    pass
+
+
+def encode_request(slots, request_id=None):
+    envelope = {
+        'v': SCHEMA_VERSION,
+        'id': request_id or uuid.uuid4().hex,
+        's': [slots[slot] for slot in SLOTS]
+    }
+    return json.dumps(envelope, separators=(',', ':'))
+
+
+def repeat_search_slots(location, cuisine, email, today):
+    return {
+        'location': location,
+        'cuisine': cuisine,
+        'party_size': REPEAT_PARTY_SIZE,
+        'date': (today + datetime.timedelta(days=1)).isoformat(),
+        'time': REPEAT_TIME,
+        'email': email
+    }
+
+
+# returns the request id and a dict of slot values
+def decode_request(body, message_attributes=None):
+    if body == MESSAGE_BODY:
+        attributes = message_attributes or {}
+        try:
+            return None, {slot: attributes[slot]['StringValue'] for slot in SLOTS}
+        except KeyError as e:
+            raise InvalidDiningRequest(f"Missing message attribute {e}")
+
+    try:
+        envelope = json.loads(body)
+    except (ValueError, TypeError) as e:
+        raise InvalidDiningRequest(f"Malformed request body: {e}")
+
+    if not isinstance(envelope, dict):
+        raise InvalidDiningRequest('Request body is not an envelope')
+    if envelope.get('v') != SCHEMA_VERSION:
+        raise InvalidDiningRequest(f"Unsupported schema version {envelope.get('v')}")
+    if len(envelope.get('s', ())) != len(SLOTS):
+        raise InvalidDiningRequest(f"Expected {len(SLOTS)} slot values")
+    return envelope.get('id'), dict(zip(SLOTS, envelope['s']))
@@ -0,0 +1,123 @@
+import datetime
+import re
+from zoneinfo import ZoneInfo
+
+
+# Slot validation shared by LF1's DialogCodeHook and LF3's repeat-last-search path,
+# bundled into the deployment package of each function that imports it.
+#
+# The rules are built once per container: allowed values are frozensets, the email pattern
+# is precompiled and every slot is parsed at most once per call. Slots are checked in
+# RULES order and the first violation is returned.
+
+
+# the bot only serves New York, dates and times are checked against the current time there
+TIMEZONE = ZoneInfo('America/New_York')
+
+LOCATION_TYPES = frozenset(['manhattan', 'nyc'])
+CUISINE_TYPES = frozenset(['american', 'italian', 'french', 'spanish', 'chinese', 'mexican', 'japanese',
+                           'korean', 'thai'])
+MIN_PARTY_SIZE = 1
+MAX_PARTY_SIZE = 12
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b')
+
+# returned by a rule whose violation comes without a message for the user
+NO_MESSAGE = ''
+
+
+def build_validation_result(is_valid, violated_slot, message_content):
+    if message_content is None:
+        return {
+            "isValid": is_valid,
+            "violatedSlot": violated_slot,
+        }
+
+    return {
+        'isValid': is_valid,
+        'violatedSlot': violated_slot,
+        'message': {'contentType': 'PlainText', 'content': message_content}
+    }
+
+
+# every rule takes the slot value, the values parsed by earlier rules and the current time,
+# and returns None when the value is valid or the message to send back otherwise
+
+def check_location(location, parsed, now):
+    if location.lower() not in LOCATION_TYPES:
+        return 'We do not have suggestions in {}, you can choose Manhattan or NYC'.format(location)
+
+
+def check_cuisine(cuisine, parsed, now):
+    if cuisine.lower() not in CUISINE_TYPES:
+        return 'We do not have suggestions in {}, please try another one such as Japanese'.format(cuisine)
+
+
+def check_party_size(party_size, parsed, now):
+    if not party_size.isnumeric():
+        return 'Party Size is invalid. Please input a valid number.'
+    if not MIN_PARTY_SIZE <= int(party_size) <= MAX_PARTY_SIZE:
+        return 'We can only give suggestions for a party with 1-12 people, please try again.'
+
+
+def check_date(date, parsed, now):
+    try:
+        parsed['date'] = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        return 'I did not understand that, you can try today or tomorrow'
+    if parsed['date'] < now.date():
+        return 'The date can not be earlier than today, please try again.'
+
+
+def check_time(time, parsed, now):
+    try:
+        parsed['time'] = datetime.datetime.strptime(time, '%H:%M').time()
+    except ValueError:
+        return 'I did not understand that, please input a valid time.'
+    if 'date' in parsed:
+        requested = datetime.datetime.combine(parsed['date'], parsed['time'], tzinfo=now.tzinfo)
+        if requested < now:
+            return 'The time can not be earlier than now, please try again.'
+    if len(time) != 5:
+        return NO_MESSAGE
+
+
+def check_email(email, parsed, now):
+    if not EMAIL_PATTERN.fullmatch(email):
+        return 'The email is invalid, please try again.'
+
+
+RULES = (
+    ('location', check_location),
+    ('cuisine', check_cuisine),
+    ('party_size', check_party_size),
+    ('date', check_date),
+    ('time', check_time),
+    ('email', check_email),
+)
+
+
+# slots maps slot names to their values, empty slots are not checked; now is an aware datetime,
+# the current time in TIMEZONE by default
+def validate_slots(slots, now=None):
+    if now is None:
+        now = datetime.datetime.now(TIMEZONE)
+    parsed = {}
+    for slot, rule in RULES:
+        value = slots.get(slot)
+        if not value:
+            continue
+        message = rule(value, parsed, now)
+        if message is not None:
+            return build_validation_result(False, slot, message or None)
+    return build_validation_result(True, None, None)
+
+
+def validate_dining_suggestions(location, cuisine, party_size, date, time, email, now=None):
+    return validate_slots({
+        'location': location,
+        'cuisine': cuisine,
+        'party_size': party_size,
+        'date': date,
+        'time': time,
+        'email': email
+    }, now)
@@ -1,60 +1,394 @@
+import argparse
+import hashlib
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from yelpapi import YelpAPI
 from pprint import pprint
 from datetime import datetime
 import os
+import sys
 import boto3
+from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy.helpers import parallel_bulk, streaming_bulk
+from requests_aws4auth import AWS4Auth
 
 session = boto3.Session(region_name='us-east-1',
                         aws_access_key_id=os.getenv('KEY_ID'),
                         aws_secret_access_key=os.getenv('SECRET_KEY'))
 IDs = set()
-def get_restaurant(cuisine, total_num = 1000):
-    with YelpAPI(os.getenv('YELP_API_KEY')) as yelp_api:
-        all_restaurants = []
-        for offset in range(0, total_num, 50):
-            print(f"Getting {cuisine}, offset: {offset}")
-            response = yelp_api.search_query(term = 'restaurants', categories = cuisine, location = 'New York',
-                                             limit = 50, offset = offset)
-            # all_restaurants.extend([res for res in response['businesses']])
-            for res in response['businesses']:
-                if res['id'] not in IDs:
-                    all_restaurants.append(res)
-                    IDs.add(res['id'])
-
-        return all_restaurants
-
-def store_DynamoDB(restaurants):
+# restaurantID -> (cuisine it was first found under, every cuisine and category alias found for it)
+searched_cuisines = {}
+
+PAGE_SIZE = 50
+# Yelp Fusion throttles bursts per API key, keep below its queries-per-second limit
+YELP_QPS = float(os.getenv('YELP_QPS', '5'))
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '4'))
+MAX_RETRIES = 5
+# state files live next to this script whatever the working directory, see .gitignore
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# journal of fetched and stored pages, one JSON object per line, read back by --resume
+STATE_FILE = os.path.join(BASE_DIR, 'ingest_state.jsonl')
+# businessID -> content hash of the record last written to DynamoDB, used by --incremental
+MANIFEST_FILE = os.path.join(BASE_DIR, 'manifest.json')
+# fields that change between searches without the business changing
+VOLATILE_FIELDS = ('distance',)
+# LF2 searches the restaurants alias, every run indexes into a new restaurants_<timestamp> index
+# and moves the alias to it once the index is complete
+INDEX_ALIAS = 'restaurants'
+BULK_CHUNK_SIZE = 500
+# Amazon OpenSearch Service rejects bulk requests above 10 MiB on the smaller instance types
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # blocks until a token is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.fetched = {}
+        self.stored = {}
+        self.stored_cuisines = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as infile:
+            lines = infile.readlines()
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # a line is cut short if the run died while writing it
+                continue
+        if len(events) < len(lines):
+            # rewritten without the torn lines, so the next append starts on a line of its own
+            print(f"Dropping {len(lines) - len(events)} torn lines from {self.path}")
+            with open(self.path + '.tmp', 'w') as outfile:
+                for event in events:
+                    outfile.write(json.dumps(event) + '\n')
+            os.replace(self.path + '.tmp', self.path)
+        for event in events:
+            key = tuple(event['page'])
+            if 'response' in event:
+                self.fetched[key] = event['response']
+            else:
+                self.stored[key] = event['hashes']
+                self.stored_cuisines[key] = event.get('cuisines', {})
+                self.fetched.pop(key, None)
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def append(self, event):
+        with self.lock:
+            with open(self.path, 'a') as outfile:
+                outfile.write(json.dumps(event) + '\n')
+
+    def page_fetched(self, key, response):
+        with self.lock:
+            self.fetched[key] = response
+        self.append({'page': key, 'response': response})
+
+    # hashes maps the IDs kept from the page to their content hashes, cuisines maps every ID
+    # on the page to its category aliases
+    def page_stored(self, key, hashes, cuisines):
+        with self.lock:
+            self.stored[key] = hashes
+            self.stored_cuisines[key] = cuisines
+            self.fetched.pop(key, None)
+        self.append({'page': key, 'hashes': hashes, 'cuisines': cuisines})
+
+
+rate_limiter = TokenBucket(YELP_QPS)
+# YelpAPI keeps a requests session, every fetch thread gets its own
+_local = threading.local()
+
+def get_yelp_api():
+    if not hasattr(_local, 'yelp_api'):
+        _local.yelp_api = YelpAPI(os.getenv('YELP_API_KEY'))
+    return _local.yelp_api
+
+def fetch_page(cuisine, offset):
+    print(f"Getting {cuisine}, offset: {offset}")
+    for attempt in range(MAX_RETRIES):
+        rate_limiter.acquire()
+        try:
+            return get_yelp_api().search_query(term = 'restaurants', categories = cuisine, location = 'New York',
+                                               limit = PAGE_SIZE, offset = offset)
+        except YelpAPI.YelpAPIError as e:
+            # Yelp answers 429 with TOO_MANY_REQUESTS_PER_SECOND when the burst limit is hit
+            if 'TOO_MANY_REQUESTS' not in str(e) or attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+def page_keys(cuisines, total_num = 1000):
+    return [(cuisine, offset) for cuisine in cuisines for offset in range(0, total_num, PAGE_SIZE)]
+
+# fetches the pages the checkpoint has neither fetched nor stored yet, in parallel
+def fetch_pages(keys, checkpoint):
+    missing = [key for key in keys if key not in checkpoint.fetched and key not in checkpoint.stored]
+    print(f"Fetching {len(missing)} of {len(keys)} pages")
+
+    def fetch(key):
+        checkpoint.page_fetched(key, fetch_page(*key))
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for _ in executor.map(fetch, missing):
+            pass
+
+# merged in cuisine and offset order, so the result does not depend on which page arrived first
+def get_restaurant(cuisine, pages):
+    all_restaurants = []
+    for response in pages:
+        # all_restaurants.extend([res for res in response['businesses']])
+        for res in response['businesses']:
+            if res['id'] not in IDs:
+                all_restaurants.append(res)
+                IDs.add(res['id'])
+
+    return all_restaurants
+
+def content_hash(res):
+    normalized = {key: value for key, value in res.items() if key not in VOLATILE_FIELDS}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as infile:
+        return json.load(infile)
+
+def save_manifest(manifest):
+    with open(MANIFEST_FILE + '.tmp', 'w') as outfile:
+        json.dump(manifest, outfile)
+    os.replace(MANIFEST_FILE + '.tmp', MANIFEST_FILE)
+
+# with a manifest, only restaurants whose content hash differs from it are written
+def store_DynamoDB(restaurants, manifest=None):
     dynamodb = session.resource('dynamodb')
     table = dynamodb.Table('yelp-restaurants')
+    written = 0
     with table.batch_writer(overwrite_by_pkeys=['businessID']) as batch:
         print(f"Wrinting to DynanmoDB")
-        for res in json.loads(json.dumps(restaurants),parse_float=Decimal):
+        for res in restaurants:
+            res_hash = content_hash(res)
+            if manifest is not None and manifest.get(res['id']) == res_hash:
+                continue
+            res = json.loads(json.dumps(res), parse_float=Decimal)
             res['businessID'] = res['id']
             del res['id']
+            res['contentHash'] = res_hash
             res['insertedAtTimestamp'] = str(datetime.now())
             batch.put_item(Item = res)
+            written += 1
+    print(f"Wrote {written} of {len(restaurants)} restaurants")
 
-def generate_ES_json(restaurants, cuisine, cur_id):
-    print('Writing to ES.json')
-    with open("ES.json", 'a') as outfile:
-        for res in json.loads(json.dumps(restaurants)):
-            first = {"index": {"_index": "restaurants", "_id": cur_id}}
-            cur_id += 1
-            outfile.write(json.dumps(first))
-            outfile.write('\n')
-            second = {'restaurantID': res['id'], 'cuisine': cuisine}
-            outfile.write(json.dumps(second))
+def delete_DynamoDB(business_ids):
+    dynamodb = session.resource('dynamodb')
+    table = dynamodb.Table('yelp-restaurants')
+    with table.batch_writer() as batch:
+        print(f"Deleting {len(business_ids)} restaurants from DynamoDB")
+        for business_id in business_ids:
+            batch.delete_item(Key={'businessID': business_id})
+
+# cuisines is a keyword field, LF2 filters on it with a term query
+RESTAURANT_MAPPING = {
+    "properties": {
+        "restaurantID": {"type": "keyword"},
+        "cuisines": {"type": "keyword"}
+    }
+}
+
+def category_aliases(res):
+    return sorted({category['alias'] for category in res.get('categories', [])})
+
+def add_cuisines(restaurant_id, cuisine, aliases):
+    first, found_under = searched_cuisines.setdefault(restaurant_id, (cuisine, set()))
+    found_under.add(cuisine)
+    found_under.update(aliases)
+
+# one document per restaurant with every cuisine it was found under, so the order in which
+# parallel_bulk applies the chunks does not matter; cuisine keeps the first one for older readers
+def index_action(index, restaurant_id):
+    first, found_under = searched_cuisines[restaurant_id]
+    return {'_op_type': 'index', '_index': index, '_id': restaurant_id,
+            '_source': {'restaurantID': restaurant_id,
+                        'cuisine': first,
+                        'cuisines': sorted(found_under)}}
+
+# LF2 caches candidate pools per cuisine and drops them once this marker changes, so it is only
+# written after every bulk action has been applied
+def write_version_marker(client):
+    client.index(index='restaurants_meta', id='version', body={'version': str(datetime.now())})
+
+# passes the actions through and writes them to path in the _bulk NDJSON format
+def export_ndjson(actions, path):
+    print(f"Writing to {path}")
+    with open(path, 'w') as outfile:
+        for action in actions:
+            meta = {key: action[key] for key in ('_index', '_id')}
+            outfile.write(json.dumps({action['_op_type']: meta}))
             outfile.write('\n')
-        return cur_id
+            if '_source' in action:
+                outfile.write(json.dumps(action['_source']))
+                outfile.write('\n')
+            yield action
+
+def get_opensearch():
+    credentials = session.get_credentials()
+    awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, session.region_name, 'es',
+                       session_token=credentials.token)
+    return OpenSearch(hosts=[os.getenv('OS_HOST')],
+                      http_auth=awsauth,
+                      use_ssl=True,
+                      verify_certs=True,
+                      connection_class=RequestsHttpConnection,
+                      timeout=60)
+
+def new_index_name():
+    return f"{INDEX_ALIAS}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+# the mapping of an existing field can not be changed, so the mapping is only ever set on a new index
+def create_index(client, index):
+    client.indices.create(index=index, body={'mappings': RESTAURANT_MAPPING})
+
+# moves the alias to index in one step and deletes the indices it pointed to before; the first
+# swap also deletes the restaurants index uploaded by hand with dynamic mappings, since an
+# alias can not have the name of an index
+# ref: https://opensearch.org/docs/latest/api-reference/index-apis/update-alias/
+def swap_alias(client, index):
+    client.indices.refresh(index=index)
+    actions = [{'add': {'index': index, 'alias': INDEX_ALIAS}}]
+    old_indices = []
+    if client.indices.exists_alias(name=INDEX_ALIAS):
+        old_indices = [name for name in client.indices.get_alias(name=INDEX_ALIAS) if name != index]
+        actions += [{'remove': {'index': name, 'alias': INDEX_ALIAS}} for name in old_indices]
+    elif client.indices.exists(index=INDEX_ALIAS):
+        actions.append({'remove_index': {'index': INDEX_ALIAS}})
+    client.indices.update_aliases(body={'actions': actions})
+    for name in old_indices:
+        client.indices.delete(index=name)
+    print(f"{INDEX_ALIAS} now points to {index}")
+
+# ref: https://opensearch.org/docs/latest/clients/python-low-level/#performing-bulk-operations
+def bulk_index(client, actions, chunk_size=BULK_CHUNK_SIZE, max_chunk_bytes=BULK_MAX_CHUNK_BYTES, threads=1):
+    options = dict(chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes, raise_on_error=False)
+    if threads > 1:
+        results = parallel_bulk(client, actions, thread_count=threads, **options)
+    else:
+        results = streaming_bulk(client, actions, max_retries=3, **options)
+    indexed = failed = 0
+    for ok, item in results:
+        if ok:
+            indexed += 1
+        else:
+            failed += 1
+            print(f"Bulk action failed: {item}")
+    print(f"Indexed {indexed} actions, {failed} failed")
+    return failed
+
+# stores the pages in cuisine and offset order, so the IDs dedup set comes out the same whether
+# or not the run was resumed, then yields one index action per restaurant for index; pages
+# stored by an earlier run are only indexed again. The index is rebuilt on every run, so
+# restaurants that disappeared from Yelp are simply not indexed again
+def ingest(cuisines, checkpoint, index=INDEX_ALIAS, incremental=False):
+    manifest = load_manifest() if incremental else None
+    hashes = {}
+    keys = page_keys(cuisines)
+    fetch_pages(keys, checkpoint)
+    for key in keys:
+        cuisine, offset = key
+        if key in checkpoint.stored:
+            IDs.update(checkpoint.stored[key])
+            hashes.update(checkpoint.stored[key])
+            page_cuisines = checkpoint.stored_cuisines[key] or dict.fromkeys(checkpoint.stored[key], [])
+        else:
+            page = checkpoint.fetched[key]
+            # the dedup only keeps a restaurant from being written to DynamoDB twice, every
+            # restaurant on the page is indexed under this cuisine
+            result = get_restaurant(cuisine, [page])
+            store_DynamoDB(result, manifest)
+            page_hashes = {res['id']: content_hash(res) for res in result}
+            hashes.update(page_hashes)
+            page_cuisines = {res['id']: category_aliases(res) for res in page['businesses']}
+            checkpoint.page_stored(key, page_hashes, page_cuisines)
+        for restaurant_id, aliases in page_cuisines.items():
+            add_cuisines(restaurant_id, cuisine, aliases)
+
+    if incremental:
+        # every page has been seen at this point, so what is left in the manifest is gone from Yelp
+        disappeared = set(manifest) - set(hashes)
+        if disappeared:
+            delete_DynamoDB(disappeared)
+    save_manifest(hashes)
+    for restaurant_id in searched_cuisines:
+        yield index_action(index, restaurant_id)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true',
+                        help=f"skip the pages {STATE_FILE} records as fetched or stored")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"only write restaurants that are new or changed since {MANIFEST_FILE} "
+                             f"to DynamoDB, and delete the ones that disappeared")
+    parser.add_argument('--export-ndjson', metavar='PATH', nargs='?', const=os.path.join(BASE_DIR, 'ES.json'),
+                        help='also write the bulk actions to PATH (default Yelp/ES.json)')
+    parser.add_argument('--no-index', action='store_true',
+                        help='do not send the actions to OS_HOST, use with --export-ndjson')
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument('--max-chunk-bytes', type=int, default=BULK_MAX_CHUNK_BYTES)
+    parser.add_argument('--bulk-threads', type=int, default=1,
+                        help='send bulk requests from this many threads with parallel_bulk')
+    args = parser.parse_args()
+
     cuisines = ['italian', 'french', 'chinese', 'greek', 'indian', 'mexican', 'japanese', 'korean', 'thai']
-    cur_id = 1
-    if os.path.exists("ES.json"):
-        os.remove("ES.json")
-    for cuisine in cuisines:
-        result = get_restaurant(cuisine)
-        cur_id = generate_ES_json(result, cuisine, cur_id)
-        store_DynamoDB(result)
+    checkpoint = Checkpoint(STATE_FILE)
+    if args.resume:
+        checkpoint.load()
+    else:
+        checkpoint.reset()
+    if args.no_index:
+        actions = ingest(cuisines, checkpoint, incremental=args.incremental)
+        if args.export_ndjson:
+            actions = export_ndjson(actions, args.export_ndjson)
+        for _ in actions:
+            pass
+    else:
+        client = get_opensearch()
+        index = new_index_name()
+        create_index(client, index)
+        actions = ingest(cuisines, checkpoint, index, args.incremental)
+        if args.export_ndjson:
+            actions = export_ndjson(actions, args.export_ndjson)
+        if bulk_index(client, actions, args.chunk_size, args.max_chunk_bytes, args.bulk_threads):
+            # the alias keeps pointing to the last complete index
+            client.indices.delete(index=index)
+            sys.exit(1)
+        swap_alias(client, index)
+        write_version_marker(client)
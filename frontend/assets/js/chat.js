@@ -25,12 +25,23 @@ $(document).ready(function() {
     }
   }
 
+  // one Lex conversation per browser tab
+  function getSessionId() {
+    var id = sessionStorage.getItem('chatSessionId');
+    if (!id) {
+      id = Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+      sessionStorage.setItem('chatSessionId', id);
+    }
+    return id;
+  }
+
   function callChatbotApi(message) {
     // params, body, additionalParams
     return sdk.chatbotPost({}, {
       messages: [{
         type: 'unstructured',
         unstructured: {
+          id: getSessionId(),
           text: message
         }
       }]